@@ -3,10 +3,13 @@ from typing import List
 class JsonStore:
     def __init__(self):
         self.facts = []
+        # Lowercased copies, built once at ingest so retrieval doesn't re-lower every fact per query
+        self._facts_lower = []
 
     def add(self, text: str):
         """Store a raw text fact."""
         self.facts.append(text)
+        self._facts_lower.append(text.lower())
 
     def retrieve(self, query: str) -> List[str]:
         """
@@ -17,9 +20,9 @@ class JsonStore:
         query_words = [w.lower().strip("?") for w in query.split() if w.lower() not in stop_words]
         
         results = []
-        for fact in self.facts:
+        for fact, fact_lower in zip(self.facts, self._facts_lower):
             # If any significant query word is in the fact, retrieve it
-            if any(qw in fact.lower() for qw in query_words):
+            if any(qw in fact_lower for qw in query_words):
                 results.append(fact)
         
         return results
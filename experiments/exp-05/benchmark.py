@@ -1,19 +1,21 @@
+import os
 import time
-import json
 import statistics
 from graph_store import GraphContextStore
 from vector_store import VectorContextStore
+from data_generator import load_dataset
 
 class Benchmark:
     def __init__(self):
         print("Loading Data...")
-        with open("experiments/exp-05/data/synthetic_dataset.json", "r") as f:
-            self.data = json.load(f)
+        self.data = load_dataset()
 
         self.graph_store = GraphContextStore()
         # Use a fresh persistent path for benchmark to avoid consistency test data
         self.vector_store = VectorContextStore(persistence_path="experiments/exp-05/chroma_benchmark")
         self.vector_store.reset()
+        if os.environ.get("EXP05_FAST_SQLITE"):
+            self.vector_store.enable_fast_sqlite()
 
     def benchmark_write(self):
         print("\n--- Benchmark: Write Speed ---")
@@ -69,10 +71,9 @@ class Benchmark:
         start = time.time()
         found_sentiment = None
         # traversing...
-        for n in self.graph_store.graph.nodes:
-            if self.graph_store.graph.nodes[n].get('type') == 'Event' and 'Review' in str(self.graph_store.graph.nodes[n].get('description')):
-                 # find related messages
-                 pass
+        for n in self.graph_store.find_events('Review'):
+            # find related messages
+            pass
         # (Simplification: Graph requires writing specific traversal code for every query type.
         # Vector is 'fuzzy' but easier to query.)
         print("Graph: [Complexity Penalty] Requires writing custom traversal code for 'during event X'.")
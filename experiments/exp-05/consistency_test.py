@@ -1,48 +1,92 @@
+import os
 import time
 import threading
 import queue
-import uuid
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Import our stores
 from graph_store import GraphContextStore
 from vector_store import VectorContextStore
 
+LATENCY_MODELS = ("fixed", "exponential", "nowait")
+
 class EventualConsistencyTest:
-    def __init__(self, store_type="graph"):
-        self.queue = queue.Queue()
+    def __init__(self, store_type="graph", queue_size=64, batch_size=16,
+                 latency_model="fixed", n_workers=1):
+        if latency_model not in LATENCY_MODELS:
+            raise ValueError(f"latency_model must be one of {LATENCY_MODELS}, got {latency_model!r}")
+
+        # Bounded so a producer that outruns the worker blocks on put() (backpressure)
+        # instead of growing the backlog without limit.
+        self.queue = queue.Queue(maxsize=queue_size)
         self.running = True
         self.store_type = store_type
+        self.batch_size = batch_size
+        self.latency_model = latency_model
+        self.n_workers = n_workers
 
         if store_type == "graph":
             self.store = GraphContextStore()
         else:
             self.store = VectorContextStore(persistence_path="experiments/exp-05/chroma_consistency_test")
             self.store.reset()
+            if os.environ.get("EXP05_FAST_SQLITE"):
+                self.store.enable_fast_sqlite()
 
-        self.marker_id = str(uuid.uuid4())
+        self.marker_id = self._new_id()
         self.marker_detected_at = None
         self.marker_injected_at = None
+        # Set by the worker once the marker has been handed to the store
+        self.marker_ready = threading.Event()
+        # Producer timestamp cache (see _now_iso)
+        self._ts_ms = None
+        self._ts_iso = None
 
     def worker(self):
         """
         Simulates the background worker processing the queue.
         Has artificial latency to simulate LLM/Embedding calls.
+        Drains up to batch_size queued records so one call covers the whole batch.
         """
         while self.running or not self.queue.empty():
             try:
-                record = self.queue.get(timeout=0.1)
+                batch = [self.queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
 
-                # Simulate processing time
-                # Vector is usually slower (embedding) than Graph (structure)
-                delay = 0.05 if self.store_type == "graph" else 0.1
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Simulate processing time (one call per batch)
+            delay = self._simulated_delay()
+            if delay:
                 time.sleep(delay)
 
-                self.store.ingest([record])
+            self.store.ingest(batch)
+            if any(record['id'] == self.marker_id for record in batch):
+                self.marker_ready.set()
+            for _ in batch:
                 self.queue.task_done()
-            except queue.Empty:
-                continue
+
+    def _simulated_delay(self):
+        """
+        'fixed' sleeps the mean delay, 'exponential' draws from an exponential
+        with that mean (long-tailed like real embedding calls), and 'nowait'
+        skips the sleep so only the queue/store code is measured.
+        """
+        if self.latency_model == "nowait":
+            return 0.0
+
+        # Vector is usually slower (embedding) than Graph (structure)
+        mean_delay = 0.05 if self.store_type == "graph" else 0.1
+        if self.latency_model == "exponential":
+            return random.expovariate(1 / mean_delay)
+        return mean_delay
 
     def producer(self, n_items=50):
         """
@@ -50,7 +94,8 @@ class EventualConsistencyTest:
         """
         # 1. Pre-noise
         for i in range(n_items // 2):
-            self.queue.put(self._create_dummy_record())
+            if not self._put(self._create_dummy_record()):
+                return
             time.sleep(0.01) # Fast inputs
 
         # 2. Marker Event
@@ -61,18 +106,48 @@ class EventualConsistencyTest:
 
         print(f"[{datetime.now().time()}] Injecting Marker Event...")
         self.marker_injected_at = time.time()
-        self.queue.put(marker)
+        if not self._put(marker):
+            return
 
         # 3. Post-noise
         for i in range(n_items // 2):
-            self.queue.put(self._create_dummy_record())
+            if not self._put(self._create_dummy_record()):
+                return
             time.sleep(0.01)
 
+    def _put(self, record):
+        """
+        Blocking put that gives up once the test stops: workers exit when running is False,
+        so a plain put() on a full queue would never return. Returns False if the record was dropped.
+        """
+        while self.running:
+            try:
+                self.queue.put(record, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _new_id():
+        # 128 random bits as hex; skips building a uuid.UUID per record
+        return os.urandom(16).hex()
+
+    def _now_iso(self):
+        """
+        datetime.now().isoformat(), recomputed at most once per millisecond.
+        """
+        now_ms = time.monotonic_ns() // 1_000_000
+        if now_ms != self._ts_ms:
+            self._ts_ms = now_ms
+            self._ts_iso = datetime.now().isoformat()
+        return self._ts_iso
+
     def _create_dummy_record(self):
         return {
-            "id": str(uuid.uuid4()),
+            "id": self._new_id(),
             "type": "Communication",
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self._now_iso(),
             "actor_name": "Test User",
             "channel": "Slack",
             "content": "Just generating some load for the system.",
@@ -85,15 +160,17 @@ class EventualConsistencyTest:
 
     def monitor(self):
         """
-        Polls the store to see when the marker appears.
+        Waits for the worker's marker signal, then confirms the marker is visible in the store.
+        Only falls back to polling if the store doesn't show it yet.
         """
-        while self.running:
-            start_query = time.time()
+        self.marker_ready.wait(timeout=10)
+
+        while self.running and self.marker_ready.is_set():
             found = False
 
             if self.store_type == "graph":
                 # Check if node exists
-                if self.marker_id in self.store.graph:
+                if self.marker_id in self.store:
                     found = True
             else:
                 # Query vector
@@ -112,11 +189,11 @@ class EventualConsistencyTest:
     def run(self):
         print(f"--- Starting Consistency Test ({self.store_type.upper()}) ---")
 
-        t_worker = threading.Thread(target=self.worker)
         t_monitor = threading.Thread(target=self.monitor)
         t_producer = threading.Thread(target=self.producer)
 
-        t_worker.start()
+        workers = ThreadPoolExecutor(max_workers=self.n_workers)
+        worker_futures = [workers.submit(self.worker) for _ in range(self.n_workers)]
         t_monitor.start()
         t_producer.start()
 
@@ -124,8 +201,10 @@ class EventualConsistencyTest:
         # Worker and Monitor will stop when Monitor finds the marker sets running=False
 
         t_monitor.join(timeout=10)
-        self.running = False # Ensure worker stops if monitor timed out
-        t_worker.join()
+        self.running = False # Ensure workers stop if monitor timed out
+        workers.shutdown(wait=True)
+        for future in worker_futures:
+            future.result() # Surface worker exceptions
 
         if self.marker_detected_at:
             lag = self.marker_detected_at - self.marker_injected_at
@@ -1,10 +1,29 @@
 import json
+import os
+import pickle
 import uuid
 import random
 from datetime import datetime, timedelta
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+if orjson is not None:
+    _dumps, _loads = orjson.dumps, orjson.loads
+else:
+    _dumps, _loads = (lambda obj: json.dumps(obj).encode()), json.loads
+
 # --- Constants & Configuration ---
 
+DATASET_PATH = "experiments/exp-05/data/synthetic_dataset.json"
+
 VALUES = [
     "Minimalism", "Frugality", "Speed", "Privacy", "Innovation",
     "Reliability", "Esthetics", "Data-Driven"
@@ -37,6 +56,9 @@ class DataGenerator:
     def __init__(self, output_file):
         self.output_file = output_file
         self.data_stream = []
+        self.record_count = 0
+        # .ndjson output is streamed to disk as records are generated instead of held in memory
+        self._f = open(output_file, 'wb') if output_file.endswith('.ndjson') else None
         self.current_time = datetime(2023, 10, 1, 9, 0, 0)
 
     def advance_time(self, minutes=0, hours=0, days=0):
@@ -58,7 +80,7 @@ class DataGenerator:
                 "participants": [profile.name, "AI_Agent"]
             }
         }
-        self.data_stream.append(event)
+        self._emit(event)
         return event
 
     def generate_communication(self, profile, goal, content, sentiment=None, implied_value=None):
@@ -79,7 +101,7 @@ class DataGenerator:
                 "implied_value": implied_value if implied_value else "None"
             }
         }
-        self.data_stream.append(comm)
+        self._emit(comm)
         return comm
 
     def generate_intent(self, profile, goal_name, description):
@@ -96,13 +118,66 @@ class DataGenerator:
                 "priority": "High"
             }
         }
-        self.data_stream.append(intent)
+        self._emit(intent)
         return intent
 
-    def save(self):
-        with open(self.output_file, 'w') as f:
-            json.dump(self.data_stream, f, indent=2)
-        print(f"Generated {len(self.data_stream)} records in {self.output_file}")
+    def _emit(self, record):
+        if self._f is not None:
+            self._f.write(_dumps(record))
+            self._f.write(b'\n')
+        else:
+            self.data_stream.append(record)
+        self.record_count += 1
+
+    def save(self, compact=False):
+        if self._f is not None:
+            self._f.close()
+        else:
+            with open(self.output_file, 'w') as f:
+                if compact:
+                    json.dump(self.data_stream, f, separators=(',', ':'))
+                else:
+                    json.dump(self.data_stream, f, indent=2)
+        print(f"Generated {self.record_count} records in {self.output_file}")
+
+def load_dataset(path=DATASET_PATH):
+    """
+    Loads the generated dataset (a JSON array, or one record per line for .ndjson).
+    The parsed records are cached in a sibling <path>.pkl (when writable), reused while it is newer than the source.
+    """
+    cache_path = path + ".pkl" # Full name, so X.json and X.ndjson get separate caches
+    if os.path.exists(cache_path) and os.path.getmtime(path) <= os.path.getmtime(cache_path):
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+
+    with open(path, 'rb') as f:
+        if path.endswith('.ndjson'):
+            data = [_loads(line) for line in f if line.strip()]
+        else:
+            data = _loads(f.read())
+
+    try:
+        with open(cache_path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass # Best-effort: a read-only checkout just re-parses next time
+    return data
+
+def iter_dataset(path=DATASET_PATH):
+    """
+    Yields records one at a time without holding the whole dataset in memory.
+    JSON arrays are streamed with ijson when it is installed; otherwise falls back to load_dataset().
+    """
+    if path.endswith('.ndjson'):
+        with open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield _loads(line)
+    elif ijson is not None:
+        with open(path, 'rb') as f:
+            yield from ijson.items(f, 'item', use_float=True)
+    else:
+        yield from load_dataset(path)
 
 # --- Scenarios ---
 
@@ -160,7 +235,7 @@ def scenario_budget_review(gen, profile):
 # --- Main Execution ---
 
 if __name__ == "__main__":
-    gen = DataGenerator("experiments/exp-05/data/synthetic_dataset.json")
+    gen = DataGenerator(DATASET_PATH)
 
     # Create a primary user
     user = Profile("Sam Patel", "CTO")
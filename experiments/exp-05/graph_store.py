@@ -1,122 +1,202 @@
 import networkx as nx
-import json
+import threading
+from collections import defaultdict
+from data_generator import load_dataset
+
+class _IngestBatch:
+    """
+    Everything one ingest() call will write: graph nodes/edges plus the index updates.
+    Indexes are only merged after the graph accepted the batch, so a record that fails
+    mid-batch leaves both the graph and the indexes untouched.
+    """
+    def __init__(self):
+        self.nodes = []
+        self.edges = []
+        self.actors = set()
+        self.msg_goals = [] # (msg_id, goal)
+        self.msg_values = [] # (msg_id, value)
+        self.person_goals = [] # (actor, goal)
+        self.person_values = [] # (actor, value)
+        self.events = [] # (event_id, {'description', 'timestamp', 'goal'})
 
 class GraphContextStore:
     def __init__(self):
         self.graph = nx.DiGraph()
+        # NetworkX isn't thread-safe; ingest and queries may run on different threads
+        self._lock = threading.RLock()
+        # Goal <-[RELATED_TO]- Message -[IMPLIES_VALUE]-> Value, kept up to date on ingest
+        self._msg_to_goals = defaultdict(set)
+        self._msg_to_values = defaultdict(set)
+        self._goal_to_values = defaultdict(set)
+        # Person -[EXHIBITS_VALUE]-> Value and Person -[WORKING_ON]-> Goal (dicts keep insertion order)
+        self._person_values = defaultdict(dict)
+        self._person_goals = defaultdict(dict)
+        # Event registry: event_id -> {'description', 'timestamp', 'goal'}
+        self._events = {}
+        self._record_handlers = {
+            'Intent': self._ingest_intent,
+            'Communication': self._ingest_communication,
+            'Episodic': self._ingest_episodic,
+        }
 
     def ingest(self, data):
         """
         Ingests JSON records into the Graph.
+        Nodes and edges are collected for the whole batch and inserted with a
+        single add_nodes_from / add_edges_from call each.
         """
-        for record in data:
-            self._process_record(record)
+        batch = _IngestBatch()
+        with self._lock:
+            for record in data:
+                self._process_record(record, batch)
+
+            self.graph.add_nodes_from(batch.nodes)
+            self.graph.add_edges_from(batch.edges)
+            self._merge_indexes(batch)
 
         print(f"Ingested {len(data)} records. Graph has {self.graph.number_of_nodes()} nodes and {self.graph.number_of_edges()} edges.")
 
-    def _process_record(self, record):
-        # 1. Ensure Actor Exists
+    def _process_record(self, record, batch):
+        """
+        Appends the record's (node, attrs) and (u, v, attrs) tuples and index updates to the batch.
+        Order is preserved so later attrs update earlier ones, as with add_node/add_edge.
+        """
+        # 1. Ensure Actor Exists (once per batch)
         actor_name = record.get('actor_name', 'Unknown')
-        self.graph.add_node(actor_name, type='Person')
-
-        # 2. Process Intent (Goal Definition)
-        if record['type'] == 'Intent':
-            goal_name = record['goal_name']
-            self.graph.add_node(goal_name, type='Goal', status=record.get('status'))
-            self.graph.add_edge(actor_name, goal_name, relation='CREATED')
-            self.graph.add_edge(actor_name, goal_name, relation='WORKING_ON')
-
-        # 3. Process Communication
-        elif record['type'] == 'Communication':
-            msg_id = record['id']
-            # Truncate content for node label
-            content_preview = record['content'][:20] + "..."
-            self.graph.add_node(msg_id, type='Message', content=record['content'], timestamp=record['timestamp'])
-
-            # Edges
-            self.graph.add_edge(actor_name, msg_id, relation='SENT')
-
-            # Link to Goal
-            if record.get('related_goal') and record['related_goal'] != "None":
-                self.graph.add_node(record['related_goal'], type='Goal') # Ensure it exists
-                self.graph.add_edge(msg_id, record['related_goal'], relation='RELATED_TO')
-
-            # Link to Value (Implicit)
-            meta = record.get('metadata', {})
-            if meta.get('implied_value') and meta['implied_value'] != "None":
-                val = meta['implied_value']
-                self.graph.add_node(val, type='Value')
-                self.graph.add_edge(msg_id, val, relation='IMPLIES_VALUE')
-                # Also reinforce the person's value
-                self.graph.add_edge(actor_name, val, relation='EXHIBITS_VALUE')
-
-            # Link to Sentiment (Emotion)
-            if meta.get('sentiment'):
-                emotion = meta['sentiment']
-                self.graph.add_node(emotion, type='Emotion')
-                self.graph.add_edge(msg_id, emotion, relation='EXPRESSES')
-
-        # 4. Process Episodic (Events)
-        elif record['type'] == 'Episodic':
-            event_id = record['id']
-            self.graph.add_node(event_id, type='Event', description=record['description'], timestamp=record['timestamp'])
-            self.graph.add_edge(actor_name, event_id, relation='PARTICIPATED_IN')
-
-            if record.get('related_goal'):
-                self.graph.add_node(record['related_goal'], type='Goal')
-                self.graph.add_edge(event_id, record['related_goal'], relation='RELATED_TO')
+        if actor_name not in batch.actors:
+            batch.actors.add(actor_name)
+            batch.nodes.append((actor_name, {'type': 'Person'}))
+
+        # 2. Dispatch on record type (Intent / Communication / Episodic)
+        handler = self._record_handlers.get(record['type'])
+        if handler is not None:
+            handler(record, actor_name, batch)
+
+    def _ingest_intent(self, record, actor_name, batch):
+        # Goal Definition
+        goal_name = record['goal_name']
+        batch.nodes.append((goal_name, {'type': 'Goal', 'status': record.get('status')}))
+        batch.edges.append((actor_name, goal_name, {'relation': 'CREATED'}))
+        batch.edges.append((actor_name, goal_name, {'relation': 'WORKING_ON'}))
+        batch.person_goals.append((actor_name, goal_name))
+
+    def _ingest_communication(self, record, actor_name, batch):
+        nodes, edges = batch.nodes, batch.edges
+        msg_id = record['id']
+        nodes.append((msg_id, {'type': 'Message', 'content': record['content'], 'timestamp': record['timestamp']}))
+
+        # Edges
+        edges.append((actor_name, msg_id, {'relation': 'SENT'}))
+
+        # Link to Goal
+        goal = record.get('related_goal')
+        if goal and goal != "None":
+            nodes.append((goal, {'type': 'Goal'})) # Ensure it exists
+            edges.append((msg_id, goal, {'relation': 'RELATED_TO'}))
+            batch.msg_goals.append((msg_id, goal))
+
+        # Link to Value (Implicit)
+        meta = record.get('metadata', {})
+        val = meta.get('implied_value')
+        if val and val != "None":
+            nodes.append((val, {'type': 'Value'}))
+            edges.append((msg_id, val, {'relation': 'IMPLIES_VALUE'}))
+            batch.msg_values.append((msg_id, val))
+            # Also reinforce the person's value
+            edges.append((actor_name, val, {'relation': 'EXHIBITS_VALUE'}))
+            batch.person_values.append((actor_name, val))
+
+        # Link to Sentiment (Emotion)
+        emotion = meta.get('sentiment')
+        if emotion:
+            nodes.append((emotion, {'type': 'Emotion'}))
+            edges.append((msg_id, emotion, {'relation': 'EXPRESSES'}))
+
+    def _ingest_episodic(self, record, actor_name, batch):
+        nodes, edges = batch.nodes, batch.edges
+        # Events
+        event_id = record['id']
+        description = record['description']
+        goal = record.get('related_goal')
+        nodes.append((event_id, {'type': 'Event', 'description': description, 'timestamp': record['timestamp']}))
+        edges.append((actor_name, event_id, {'relation': 'PARTICIPATED_IN'}))
+        batch.events.append((event_id, {
+            'description': description,
+            'timestamp': record['timestamp'],
+            'goal': goal,
+        }))
+
+        if goal:
+            nodes.append((goal, {'type': 'Goal'}))
+            edges.append((event_id, goal, {'relation': 'RELATED_TO'}))
+
+    def _merge_indexes(self, batch):
+        """
+        Applies a batch's index updates; called under the lock once the graph holds the batch.
+        """
+        for msg_id, goal in batch.msg_goals:
+            self._msg_to_goals[msg_id].add(goal)
+            self._goal_to_values[goal].update(self._msg_to_values.get(msg_id, ()))
+        for msg_id, val in batch.msg_values:
+            self._msg_to_values[msg_id].add(val)
+            for related_goal in self._msg_to_goals.get(msg_id, ()):
+                self._goal_to_values[related_goal].add(val)
+        for actor_name, goal_name in batch.person_goals:
+            self._person_goals[actor_name][goal_name] = None
+        for actor_name, val in batch.person_values:
+            self._person_values[actor_name][val] = None
+        self._events.update(batch.events)
 
     def find_implicit_constraints(self, goal_name):
         """
-        Traverses the graph to find values implied by messages related to a goal.
+        Finds values implied by messages related to a goal.
         Path: Goal <-[RELATED_TO]- Message -[IMPLIES_VALUE]-> Value
+        The path is precomputed at ingest time, so this is a single dict lookup.
         """
-        if goal_name not in self.graph:
-            return []
-
-        constraints = []
-        # Incoming edges to goal (Messages/Events related to it)
-        predecessors = self.graph.predecessors(goal_name)
-
-        for node in predecessors:
-            if self.graph.nodes[node].get('type') == 'Message':
-                # Check what this message implies
-                for neighbor in self.graph.successors(node):
-                    if self.graph.nodes[neighbor].get('type') == 'Value':
-                        constraints.append(neighbor)
-
-        return list(set(constraints)) # Dedupe
+        with self._lock:
+            return list(self._goal_to_values.get(goal_name, ()))
 
     def get_person_profile(self, name):
         """
         Returns known values and active goals for a person.
         """
-        if name not in self.graph:
-            return {}
+        with self._lock:
+            if name not in self.graph:
+                return {}
 
-        values = []
-        goals = []
+            return {
+                "values": list(self._person_values.get(name, ())),
+                "goals": list(self._person_goals.get(name, ())),
+            }
 
-        for neighbor in self.graph.successors(name):
-            node_type = self.graph.nodes[neighbor].get('type')
-            relation = self.graph[name][neighbor]['relation']
-
-            if node_type == 'Value' and relation == 'EXHIBITS_VALUE':
-                values.append(neighbor)
-            elif node_type == 'Goal' and relation == 'WORKING_ON':
-                goals.append(neighbor)
+    def find_events(self, substring):
+        """
+        Returns ids of events whose description contains the substring.
+        Scans the event registry only, not the whole graph.
+        """
+        with self._lock:
+            return [event_id for event_id, event in self._events.items()
+                    if substring in event['description']]
 
-        return {"values": list(set(values)), "goals": goals}
+    def __contains__(self, node):
+        with self._lock:
+            return node in self.graph
 
     def reset(self):
-        self.graph.clear()
+        with self._lock:
+            self.graph.clear()
+            self._msg_to_goals.clear()
+            self._msg_to_values.clear()
+            self._goal_to_values.clear()
+            self._person_values.clear()
+            self._person_goals.clear()
+            self._events.clear()
 
 # Quick test
 if __name__ == "__main__":
     store = GraphContextStore()
 
-    with open("experiments/exp-05/data/synthetic_dataset.json", "r") as f:
-        data = json.load(f)
+    data = load_dataset()
 
     store.ingest(data)
 
@@ -1,45 +1,339 @@
 import chromadb
 from chromadb.utils import embedding_functions
+import hashlib
 import json
 import os
+import pickle
+import queue
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import numpy as np
+import torch
+from collections import OrderedDict
 from sentence_transformers import SentenceTransformer
+from data_generator import iter_dataset
+
+class EmbeddingCache:
+    """
+    LRU cache of query embeddings, keyed by the SHA-256 digest of the query text.
+    Only calls the encoder on a miss; hits/misses are counted for benchmarking.
+    """
+    def __init__(self, encode, maxsize=1024):
+        self._encode = encode
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text):
+        key = hashlib.sha256(text.encode()).digest()
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        # Encode outside the lock so a slow model call doesn't block cache hits
+        vector = self._encode([text])[0]
+        with self._lock:
+            self._entries[key] = vector
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return vector
+
+class RegionCache:
+    """
+    QVCache-style result cache in front of the vector search.
+    Each entry is (unit query vector, similarity threshold, result). A new query reuses
+    the result of the closest entry if its cosine similarity clears that entry's threshold.
+    Entry vectors live in one float32 matrix (a ring buffer), so a lookup is a single matvec.
+    Every clear() bumps `generation`; put() drops results computed under an older generation,
+    so a query that raced an ingest can't repopulate the cache with pre-write results.
+    Results are lists of hit dicts; get()/put() copy the list and dicts, nested values are shared
+    and must be treated as read-only.
+    """
+    def __init__(self, maxsize=2048, threshold=0.95):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._centers = None # (maxsize, dim), allocated on first put
+        self._thresholds = np.empty(maxsize, dtype=np.float32)
+        self._n_results = np.empty(maxsize, dtype=np.int64)
+        self._results = [None] * maxsize
+        self._size = 0
+        self._next = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def get(self, vector, n_results):
+        q = self._unit(vector)
+        with self._lock:
+            if not self._size:
+                return None
+            sims = self._centers[:self._size] @ q
+            misses = (self._n_results[:self._size] != n_results) | (sims < self._thresholds[:self._size])
+            sims[misses] = -np.inf
+            best = int(np.argmax(sims))
+            if not np.isfinite(sims[best]):
+                return None
+            result = self._results[best]
+        return [dict(hit) for hit in result]
+
+    def put(self, vector, n_results, result, generation):
+        """
+        Caches result, unless the cache was cleared since `generation` was read (before the search).
+        """
+        q = self._unit(vector)
+        result = [dict(hit) for hit in result]
+        with self._lock:
+            if generation != self.generation:
+                return
+            if self._centers is None:
+                self._centers = np.empty((self.maxsize, q.shape[0]), dtype=np.float32)
+            i = self._next
+            self._centers[i] = q
+            self._thresholds[i] = self.threshold
+            self._n_results[i] = n_results
+            self._results[i] = result
+            self._next = (i + 1) % self.maxsize
+            self._size = min(self._size + 1, self.maxsize)
+
+    def clear(self):
+        with self._lock:
+            self._results = [None] * self.maxsize
+            self._size = 0
+            self._next = 0
+            self.generation += 1
 
 class VectorContextStore:
-    def __init__(self, persistence_path="experiments/exp-05/chroma_db"):
+    # Records per encode + collection.add round; bounds per-batch memory on large ingests
+    ADD_BATCH_SIZE = 5000
+    # Inner-product space. Invariant: every vector added or queried must be L2-normalized
+    # (encode(..., normalize_embeddings=True)), which makes ip rank exactly like cosine
+    # without Chroma dividing by norms on every distance evaluation.
+    COLLECTION_METADATA = {"hnsw:space": "ip"}
+    # Loaded models shared by every store in the process, keyed by (device, backend)
+    _MODELS = {}
+    _MODEL_LOCK = threading.Lock()
+
+    def __init__(self, persistence_path="experiments/exp-05/chroma_db", cache_threshold=None, backend="torch",
+                 pca_components=None, n_shards=1):
+        if n_shards < 1:
+            raise ValueError(f"n_shards must be >= 1, got {n_shards}")
+        self.persistence_path = persistence_path
         self.client = chromadb.PersistentClient(path=persistence_path)
 
+        # Full records live in a side table keyed by id; Chroma metadata keeps only filterable fields
+        self._records_db = sqlite3.connect(os.path.join(persistence_path, "records.db"), check_same_thread=False)
+        self._records_db.execute("CREATE TABLE IF NOT EXISTS records (id TEXT PRIMARY KEY, json TEXT)")
+        self._records_lock = threading.Lock()
+
         # We use a custom embedding function wrapper for SentenceTransformer
         # or we can use Chroma's built-in if compatible.
-        # For control, I'll instantiate the model myself.
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        # For control, I'll instantiate the model myself (once per process, see _load_model).
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model = self._load_model(device, backend)
+        self.encode_batch_size = 256 if device == "cuda" else 64
+        # Repeated queries (e.g. the consistency monitor's polling) skip the model
+        self.query_embeddings = EmbeddingCache(lambda texts: self.model.encode(texts, normalize_embeddings=True))
+        # Opt-in (e.g. cache_threshold=0.95): near-duplicate queries reuse a previous result, cleared
+        # whenever the data changes. Off by default, since an approximate hit isn't real retrieval.
+        self.result_cache = RegionCache(threshold=cache_threshold) if cache_threshold is not None else None
 
-        self.collection = self.client.get_or_create_collection(
-            name="human_context",
-            metadata={"hnsw:space": "cosine"}
-        )
+        # Optional PCA projection (e.g. 384 -> 128 dims) applied to every vector sent to Chroma.
+        # Fitted on a sample of the first ingest and persisted next to the collection. A persisted PCA
+        # is always loaded (the collection only accepts projected vectors), whatever the argument.
+        self.pca_components = pca_components
+        self._pca_path = os.path.join(persistence_path, "pca.pkl")
+        self._pca = None
+        self._pca_lock = threading.Lock()
+        if os.path.exists(self._pca_path):
+            with open(self._pca_path, 'rb') as f:
+                self._pca = pickle.load(f)
+            if pca_components not in (None, self._pca.n_components_):
+                raise ValueError(
+                    f"Store at {persistence_path} was built with pca_components={self._pca.n_components_}, "
+                    f"got {pca_components}; reset() it to change the projection"
+                )
+            self.pca_components = self._pca.n_components_
+
+        # Records are spread over n_shards collections by a stable hash of their id; ingest and
+        # queries fan out over a thread pool. One shard keeps the original "human_context" collection.
+        # The layout on disk must match: with the wrong n_shards, queries would silently miss records.
+        self.n_shards = n_shards
+        existing = self._existing_collection_names()
+        if existing and set(existing) != set(self._collection_names()):
+            raise ValueError(
+                f"Store at {persistence_path} holds collections {existing}, which don't match "
+                f"n_shards={n_shards}; open it with the n_shards it was built with"
+            )
+        self.collections = [
+            self.client.get_or_create_collection(name=name, metadata=self.COLLECTION_METADATA)
+            for name in self._collection_names()
+        ]
+        self.collection = self.collections[0]
+        self._shard_pool = ThreadPoolExecutor(max_workers=n_shards) if n_shards > 1 else None
+
+    @classmethod
+    def _load_model(cls, device, backend):
+        """
+        Returns the shared encoder for (device, backend), loading it on first use.
+        On CUDA, the torch model runs in fp16 (tensor cores, half the memory traffic).
+        backend="onnx" / "openvino" serves it through ONNX Runtime / OpenVINO instead, which is
+        the faster option on CPU-only machines (needs sentence-transformers>=3.2 and optimum).
+        """
+        with cls._MODEL_LOCK:
+            model = cls._MODELS.get((device, backend))
+            if model is None:
+                model_kwargs = {} if backend == "torch" else {"backend": backend}
+                model = SentenceTransformer('all-MiniLM-L6-v2', device=device, **model_kwargs)
+                if device == "cuda" and backend == "torch":
+                    model.half()
+                cls._MODELS[(device, backend)] = model
+            return model
+
+    # Per-type body of the serialized text (see _serialize_to_text)
+    _SERIALIZERS = {
+        'Communication': lambda r, md: (
+            f"{r.get('actor_name')} via {r.get('channel')}: \"{r.get('content')}\". "
+            f"Sentiment: {md.get('sentiment')}. "
+        ),
+        'Episodic': lambda r, md: (
+            f"{r.get('event_type')}: {r.get('description')}. "
+            f"Participants: {', '.join(md.get('participants', []))}. "
+        ),
+        'Intent': lambda r, md: (
+            f"Goal: {r.get('goal_name')}. {r.get('description')}. "
+            f"Status: {r.get('status')}. "
+        ),
+    }
 
     def _serialize_to_text(self, record):
         """
         Converts a JSON record into a semantic string for embedding.
         """
-        text = f"[{record['type']}] {record.get('timestamp', '')} "
+        rtype = record['type']
+        parts = [f"[{rtype}] {record.get('timestamp', '')} "]
 
-        if record['type'] == 'Communication':
-            text += f"{record.get('actor_name')} via {record.get('channel')}: \"{record.get('content')}\". "
-            text += f"Sentiment: {record['metadata'].get('sentiment')}. "
+        serializer = self._SERIALIZERS.get(rtype)
+        if serializer is not None:
+            # Metadata is looked up once and handed to the serializer
+            parts.append(serializer(record, record.get('metadata') or {}))
 
-        elif record['type'] == 'Episodic':
-            text += f"{record.get('event_type')}: {record.get('description')}. "
-            text += f"Participants: {', '.join(record['metadata'].get('participants', []))}. "
+        if 'related_goal' in record:
+            parts.append(f"Context: Related to {record['related_goal']}.")
 
-        elif record['type'] == 'Intent':
-            text += f"Goal: {record.get('goal_name')}. {record.get('description')}. "
-            text += f"Status: {record.get('status')}. "
+        return "".join(parts)
 
-        if 'related_goal' in record:
-            text += f"Context: Related to {record['related_goal']}."
+    # Record metadata fields copied into Chroma metadata because they are useful for filtering
+    _FILTER_FIELDS = ('sentiment', 'implied_value')
+
+    @classmethod
+    def _flatten_metadata(cls, record):
+        """
+        Flattens a record into Chroma metadata (it prefers flat dicts of str/int/float).
+        """
+        meta = {
+            "type": record['type'],
+            "timestamp": record.get('timestamp', ""),
+            "actor_name": record.get('actor_name', ""),
+            "related_goal": record.get('related_goal', "None"),
+        }
+        record_meta = record.get('metadata')
+        if record_meta:
+            for field in cls._FILTER_FIELDS:
+                if field in record_meta:
+                    meta[field] = record_meta[field]
+        return meta
+
+    def _collection_names(self):
+        if self.n_shards == 1:
+            return ["human_context"]
+        return [f"human_context_{i}" for i in range(self.n_shards)]
+
+    _COLLECTION_NAME_RE = re.compile(r"human_context(_\d+)?")
+
+    def _existing_collection_names(self):
+        """
+        Names of the store's collections already in the client, for any shard count.
+        """
+        return sorted(
+            collection.name for collection in self.client.list_collections()
+            if self._COLLECTION_NAME_RE.fullmatch(collection.name)
+        )
+
+    def _shard_of(self, record_id):
+        # hashlib rather than hash(): str hashes are salted per process, shard ids must be stable
+        digest = hashlib.blake2b(record_id.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') % self.n_shards
+
+    def _add_to_shards(self, ids, documents, embeddings, metadatas, record_json):
+        """
+        Adds one encoded chunk, split by shard, with one concurrent collection.add per shard.
+        Each shard's full records are stored once its add() succeeded, so a failure in one shard
+        doesn't leave the others serving hits without records. Re-raises the first shard error.
+        """
+        if self.n_shards == 1:
+            self.collection.add(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+            self._store_records(ids, record_json)
+            return
+
+        buckets = [[] for _ in range(self.n_shards)]
+        for i, record_id in enumerate(ids):
+            buckets[self._shard_of(record_id)].append(i)
+
+        futures = []
+        for collection, bucket in zip(self.collections, buckets):
+            if not bucket:
+                continue
+            bucket_ids = [ids[i] for i in bucket]
+            futures.append((bucket_ids, self._shard_pool.submit(
+                collection.add,
+                ids=bucket_ids,
+                documents=[documents[i] for i in bucket],
+                embeddings=embeddings[bucket],
+                metadatas=[metadatas[i] for i in bucket],
+            )))
+        error = None
+        for bucket_ids, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            self._store_records(bucket_ids, record_json)
+        if error is not None:
+            raise error
 
-        return text
+    def _store_records(self, ids, record_json):
+        # INSERT OR IGNORE matches add(), which keeps the existing entry for a known id
+        rows = [(record_id, record_json[record_id]) for record_id in ids]
+        with self._records_lock, self._records_db:
+            self._records_db.executemany("INSERT OR IGNORE INTO records (id, json) VALUES (?, ?)", rows)
+
+    def ingest_iter(self, records, batch_size=ADD_BATCH_SIZE):
+        """
+        Ingests records from any iterable (e.g. a streaming parser), batch_size records at a time,
+        so peak memory is bounded by the batch rather than the dataset.
+        """
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                self.ingest(batch)
+                batch = []
+        if batch:
+            self.ingest(batch)
 
     def ingest(self, data):
         """
@@ -49,82 +343,210 @@ class VectorContextStore:
         documents = []
         metadatas = []
         embeddings = []
+        record_json = {}
 
         for record in data:
-            text_rep = self._serialize_to_text(record)
-
-            # Flatten metadata for Chroma (it prefers flat dicts of str/int/float)
-            meta = {
-                "type": record['type'],
-                "timestamp": record.get('timestamp', ""),
-                "actor_name": record.get('actor_name', ""),
-                "related_goal": record.get('related_goal', "None"),
-                "json_dump": json.dumps(record) # Store full record to retrieve later
-            }
-            # Add specific metadata fields that might be useful for filtering
-            if 'metadata' in record:
-                if 'sentiment' in record['metadata']:
-                    meta['sentiment'] = record['metadata']['sentiment']
-                if 'implied_value' in record['metadata']:
-                    meta['implied_value'] = record['metadata']['implied_value']
-
             ids.append(record['id'])
-            documents.append(text_rep)
-            metadatas.append(meta)
+            documents.append(self._serialize_to_text(record))
+            metadatas.append(self._flatten_metadata(record))
+            record_json[record['id']] = json.dumps(record) # Store full record to retrieve later
 
             # Compute embedding
             # Note: doing this in batch is faster, but for clarity/simplicity in this loop:
             # We will batch it outside.
 
-        # Batch embedding calculation
-        embeddings = self.model.encode(documents).tolist()
+        pca = None
+        if self.pca_components:
+            # Fit before the length sort, so the sample isn't biased to short texts
+            pca = self._fit_pca(documents)
 
-        self.collection.add(
-            ids=ids,
-            documents=documents,
-            embeddings=embeddings,
-            metadatas=metadatas
-        )
+        # Smart batching: order by text length so each encode mini-batch pads to similar lengths.
+        # ids/metadatas are permuted with the documents, so no un-permute is needed before add().
+        order = sorted(range(len(documents)), key=lambda i: len(documents[i]))
+        ids = [ids[i] for i in order]
+        documents = [documents[i] for i in order]
+        metadatas = [metadatas[i] for i in order]
+
+        # Batch embedding calculation, one chunk of ADD_BATCH_SIZE records at a time.
+        # This thread encodes chunk N+1 while a writer thread adds chunk N to Chroma;
+        # the bounded queue holds at most two encoded chunks (backpressure on the encoder).
+        # Full records are written per chunk (per shard) only after its add() succeeds, so both sides agree.
+        pending = queue.Queue(maxsize=2)
+        errors = []
+
+        def writer():
+            while True:
+                chunk = pending.get()
+                if chunk is None:
+                    return
+                if errors:
+                    continue # Keep draining so the encoder never blocks on a failed writer
+                try:
+                    self._add_to_shards(*chunk, record_json)
+                except Exception as e:
+                    errors.append(e)
+
+        t_writer = threading.Thread(target=writer)
+        t_writer.start()
+        try:
+            for start in range(0, len(ids), self.ADD_BATCH_SIZE):
+                end = start + self.ADD_BATCH_SIZE
+                embeddings = self.model.encode(
+                    documents[start:end], batch_size=self.encode_batch_size, normalize_embeddings=True
+                )
+                if self.pca_components:
+                    embeddings = self._project(embeddings, pca)
+                # Chroma takes float32 ndarrays as-is; no per-scalar Python float lists
+                embeddings = embeddings.astype(np.float32, copy=False)
+                pending.put((ids[start:end], documents[start:end], embeddings, metadatas[start:end]))
+        finally:
+            pending.put(None)
+            t_writer.join()
+            # Earlier chunks may have been written even if a later one failed
+            if self.result_cache is not None:
+                self.result_cache.clear()
+
+        if errors:
+            raise errors[0]
         print(f"Ingested {len(ids)} records into Vector Store.")
 
     def query(self, query_text, n_results=5, filter_criteria=None):
         """
         Queries the store.
+        Unfiltered queries go through the region cache first, if it is enabled.
         """
-        query_embedding = self.model.encode([query_text]).tolist()
+        query_vector = self.query_embeddings.get(query_text)
+        cacheable = filter_criteria is None and self.result_cache is not None
+        if cacheable:
+            # Read before searching: if an ingest clears the cache meanwhile, put() discards this result
+            generation = self.result_cache.generation
+            cached = self.result_cache.get(query_vector, n_results)
+            if cached is not None:
+                return cached
+
+        pca = self._pca
+        if self.pca_components and pca is None:
+            return [] # Nothing ingested since the store was created or reset
 
-        results = self.collection.query(
+        query_embedding = query_vector[np.newaxis].astype(np.float32, copy=False)
+        if self.pca_components:
+            query_embedding = self._project(query_embedding, pca)
+
+        query_kwargs = dict(
             query_embeddings=query_embedding,
             n_results=n_results,
             where=filter_criteria # e.g., {"type": "Communication"}
         )
+        if self.n_shards == 1:
+            shard_results = [self.collection.query(**query_kwargs)]
+        else:
+            shard_results = list(self._shard_pool.map(lambda c: c.query(**query_kwargs), self.collections))
+
+        # Format results (one zip over the parallel result columns of each shard)
+        hits = []
+        for results in shard_results:
+            if results['ids']:
+                hits.extend(zip(
+                    results['ids'][0], results['documents'][0], results['metadatas'][0], results['distances'][0]
+                ))
+        if self.n_shards > 1:
+            # Each shard returned its own top n_results; keep the global top n_results
+            hits.sort(key=lambda hit: hit[3])
+            hits = hits[:n_results]
 
-        # Format results
-        formatted_results = []
-        if results['ids']:
-            for i in range(len(results['ids'][0])):
-                formatted_results.append({
-                    "id": results['ids'][0][i],
-                    "document": results['documents'][0][i],
-                    "metadata": results['metadatas'][0][i],
-                    "distance": results['distances'][0][i]
-                })
+        records = self.get_records([hit[0] for hit in hits])
+        formatted_results = [
+            {"id": id_, "document": doc, "metadata": meta, "distance": dist, "record": records.get(id_)}
+            for id_, doc, meta, dist in hits
+        ]
 
+        if cacheable:
+            self.result_cache.put(query_vector, n_results, formatted_results, generation)
         return formatted_results
 
+    def _fit_pca(self, documents):
+        """
+        Returns the store's PCA, first fitting it on a uniform random sample of up to ADD_BATCH_SIZE
+        of the documents (fixed seed, so rebuilding a store gives the same projection) and persisting it.
+        """
+        with self._pca_lock:
+            if self._pca is not None:
+                return self._pca
+            if len(documents) < self.pca_components:
+                raise ValueError(
+                    f"Need at least {self.pca_components} records in the first ingest to fit "
+                    f"the PCA, got {len(documents)}"
+                )
+            rng = np.random.default_rng(0)
+            sample = rng.choice(len(documents), size=min(len(documents), self.ADD_BATCH_SIZE), replace=False)
+            embeddings = self.model.encode(
+                [documents[i] for i in sample], batch_size=self.encode_batch_size, normalize_embeddings=True
+            )
+            from sklearn.decomposition import IncrementalPCA
+            self._pca = IncrementalPCA(n_components=self.pca_components).fit(embeddings)
+            with open(self._pca_path, 'wb') as f:
+                pickle.dump(self._pca, f)
+            return self._pca
+
+    @staticmethod
+    def _project(embeddings, pca):
+        """
+        Projects embeddings through a fitted PCA and re-normalizes them (the ip space needs unit vectors).
+        """
+        projected = pca.transform(embeddings).astype(np.float32)
+        projected /= np.maximum(np.linalg.norm(projected, axis=1, keepdims=True), 1e-12)
+        return projected
+
+    def get_records(self, ids):
+        """
+        Returns {id: full original record} for the given ids (unknown ids are skipped).
+        """
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._records_lock:
+            rows = self._records_db.execute(
+                f"SELECT id, json FROM records WHERE id IN ({placeholders})", list(ids)
+            ).fetchall()
+        return {record_id: json.loads(blob) for record_id, blob in rows}
+
+    def enable_fast_sqlite(self):
+        """
+        Switches Chroma's SQLite file to WAL journaling for throwaway benchmark stores.
+        journal_mode is persisted in the file, so Chroma's own connections pick it up.
+        """
+        db_path = os.path.join(self.persistence_path, "chroma.sqlite3")
+        with closing(sqlite3.connect(db_path)) as conn:
+            conn.execute("pragma journal_mode = WAL")
+
     def reset(self):
-        self.client.delete_collection("human_context")
-        self.collection = self.client.create_collection("human_context")
+        """
+        Drops and recreates the collection (every shard), the records table and the caches.
+        The encoder is left alone (it is shared via _MODELS), so resets don't pay model load time.
+        """
+        # Drops every shard collection present, including ones left by a different n_shards
+        for name in self._existing_collection_names():
+            self.client.delete_collection(name)
+        self.collections = [
+            self.client.create_collection(name, metadata=self.COLLECTION_METADATA) for name in self._collection_names()
+        ]
+        self.collection = self.collections[0]
+        with self._records_lock, self._records_db:
+            self._records_db.execute("DELETE FROM records")
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        # The new collection has no fixed dimensionality yet, so the PCA is refitted on the next ingest
+        with self._pca_lock:
+            self._pca = None
+            if os.path.exists(self._pca_path):
+                os.remove(self._pca_path)
 
 # Quick test if run directly
 if __name__ == "__main__":
     store = VectorContextStore()
 
-    # Load data
-    with open("experiments/exp-05/data/synthetic_dataset.json", "r") as f:
-        data = json.load(f)
-
-    store.ingest(data)
+    # Stream data in batches
+    store.ingest_iter(iter_dataset())
 
     # Test Query
     print("\n--- Query: 'Why did Sam dislike the design?' ---")